@@ -25,10 +25,12 @@ base = pwndbg.aglib.kernel.arch_paginginfo().kbase
 elf = niche_elf.ELFFile(base)
 for sym_name, sym_type, sym_addr in syms:
     # I trust bata: bata24/gef.py:create_symboled_elf()
+    # The binding constants are available from niche_elf directly, no need to pull in
+    # pyelftools just for these.
     if sym_type and sym_type in "abcdefghijklmnopqrstuvwxyz":
-        bind: int = cast(int, ENUM_ST_INFO_BIND["STB_LOCAL"])
+        bind: int = niche_elf.Constants.STB_LOCAL
     else:
-        bind = cast(int, ENUM_ST_INFO_BIND["STB_GLOBAL"])
+        bind = niche_elf.Constants.STB_GLOBAL
 
     if sym_type in ["T", "t", "W", None]:
         elf.add_function(sym_name, sym_addr, bind=bind)
@@ -1,14 +1,152 @@
 """Handles crafting a minimal ELF file using structured classes."""
 
+from __future__ import annotations
+
+import array
+import contextlib
 import ctypes
+import io
+import itertools
+import operator
+import os
+import sys
 from pathlib import Path
+from typing import Literal, cast
 
 from . import datatypes
-from .structures import Section, SHStrTab, Symbol
+from .structures import Section, SectionHeader, SHStrTab, SymbolTable
+
+_IOV_MAX = 1024
+
+# Files smaller than this are not worth an extra syscall to preallocate.
+_PREALLOCATE_MIN = 1024 * 1024
+
+
+# sizeof(Elf32_Sym) and sizeof(Elf64_Sym), by pointer width.
+_SYM_ENTSIZE = {32: ctypes.sizeof(datatypes.ElfSym32), 64: ctypes.sizeof(datatypes.ElfSym64)}
+
+# Shared source of padding bytes, so emitting padding doesn't allocate.
+_ZEROS = memoryview(bytes(0x100))
+
+
+def _padding(size: int) -> bytes | memoryview:
+    """Return `size` null bytes."""
+    if size <= len(_ZEROS):
+        return _ZEROS[:size]
+    return bytes(size)
+
+
+def _scatter(buf: bytearray, column: array.array[int], field_offset: int, entsize: int) -> None:
+    """
+    Store `column` into one field of consecutive `entsize` sized entries of `buf`.
+
+    The first entry is skipped, and `field_offset` has to be a multiple of the column item size
+    (which is always the case for naturally aligned ELF structures).
+    """
+    if sys.byteorder != "little":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    itemsize = column.itemsize
+    typecode = cast('Literal["B", "H", "I", "Q"]', column.typecode)
+    with memoryview(buf).cast(typecode) as view:
+        view[(entsize + field_offset) // itemsize :: entsize // itemsize] = memoryview(column)
+
+
+def _pack_symtab(
+    ptrbits: int,
+    symbols: SymbolTable,
+    st_name: array.array[int],
+) -> bytearray:
+    """
+    Serialize `symbols` into symbol table entries, preceded by the mandatory null symbol.
+
+    `ptrbits` picks between the Elf32_Sym and Elf64_Sym layout, and `st_name` holds the strtab
+    offset of every symbol name.
+
+    This is the hot path when writing a lot of symbols, so rather than packing the entries one
+    by one, every column of `symbols` is copied into its field of all the entries at once with
+    a strided memoryview assignment. That way there is no Python code running per symbol.
+    """
+    entsize = _SYM_ENTSIZE[ptrbits]
+    count = len(symbols)
+    buf = bytearray(entsize * (count + 1))
+    st_shndx = array.array("H", [1]) * count  # Sucks that we are hardcoding, this is .text
+    # st_other is left zeroed.
+    match ptrbits:
+        case 64:
+            # Elf64_Sym: st_name, st_info, st_other, st_shndx, st_value, st_size
+            _scatter(buf, st_name, 0, entsize)
+            _scatter(buf, symbols.infos, 4, entsize)
+            _scatter(buf, st_shndx, 6, entsize)
+            _scatter(buf, symbols.values, 8, entsize)
+            _scatter(buf, symbols.sizes, 16, entsize)
+        case 32:
+            # Elf32_Sym: st_name, st_value, st_size, st_info, st_other, st_shndx
+            _scatter(buf, st_name, 0, entsize)
+            _scatter(buf, array.array("I", symbols.values), 4, entsize)
+            _scatter(buf, array.array("I", symbols.sizes), 8, entsize)
+            _scatter(buf, symbols.infos, 12, entsize)
+            _scatter(buf, st_shndx, 14, entsize)
+    return buf
+
+
+def _write_chunks(path: str, chunks: list[bytes | bytearray | memoryview]) -> None:
+    """Write `chunks` back to back into the file at `path`, using as few syscalls as possible."""
+    total = sum(map(len, chunks))
+    if not hasattr(os, "writev"):
+        # Windows. Size the file buffer to fit everything, so the chunks are coalesced
+        # into a single write when the file is closed.
+        with Path(path).open("wb", buffering=max(io.DEFAULT_BUFFER_SIZE, total)) as f:
+            f.writelines(chunks)
+        return
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        # We know the final size up front, so let the filesystem allocate the whole file
+        # at once instead of growing it piece by piece as the data comes in. On ext4 this
+        # makes overwriting an existing file several times faster.
+        # Beware that on filesystems without fallocate(2) (e.g. ext2), glibc emulates this by
+        # writing to every block of the file, and then writev writes all of it again. That
+        # makes the write about twice as slow there, but the common filesystems support it.
+        if total >= _PREALLOCATE_MIN and hasattr(os, "posix_fallocate"):
+            with contextlib.suppress(OSError):
+                # E.g. when `path` is not a regular file. It's only an optimization anyway.
+                os.posix_fallocate(fd, 0, total)
+        while chunks:
+            # The kernel caps the number of buffers per call at IOV_MAX (1024 on Linux).
+            written = os.writev(fd, chunks[:_IOV_MAX])
+            # Drop whatever made it out, writev is allowed to write less than asked.
+            while chunks and written >= len(chunks[0]):
+                written -= len(chunks[0])
+                chunks = chunks[1:]
+            if written:
+                chunks[0] = memoryview(chunks[0])[written:]
+    finally:
+        os.close(fd)
 
 
 def align(offset: int, alignment: int) -> int:
-    return (offset + alignment - 1) & ~(alignment - 1)
+    # `-alignment` is the same mask as `~(alignment - 1)` for powers of two.
+    return (offset + alignment - 1) & -alignment
+
+
+# The NULL section is always the same and never modified, so all builders share it.
+_NULL_SECTION = Section(
+    "doesntmatter",
+    b"",
+    header=SectionHeader(
+        sh_name=0,
+        sh_type=0,
+        sh_flags=0,
+        sh_addr=0,
+        sh_size=0,
+        sh_link=0,
+        sh_info=0,
+        sh_addralign=1,
+        sh_entsize=0,
+        sh_offset=0,
+    ),
+)
 
 
 # Section `sh_addralign` values taken from a normal executable.
@@ -20,10 +158,9 @@ class ELFBuilder:
         if ptrbits not in {32, 64}:
             raise AssertionError(f"ptrbits must be 32 or 64, but is {ptrbits}")
 
-        self.ElfEhdr = {32: datatypes.ElfEhdr32, 64: datatypes.ElfEhdr64}[ptrbits]
         self.ElfPhdr = {32: datatypes.ElfPhdr32, 64: datatypes.ElfPhdr64}[ptrbits]
-        self.ElfShdr = {32: datatypes.ElfShdr32, 64: datatypes.ElfShdr64}[ptrbits]
-        self.ElfSym = {32: datatypes.ElfSym32, 64: datatypes.ElfSym64}[ptrbits]
+        self.EhdrStruct = {32: datatypes.EHDR32_STRUCT, 64: datatypes.EHDR64_STRUCT}[ptrbits]
+        self.ShdrStruct = {32: datatypes.SHDR32_STRUCT, 64: datatypes.SHDR64_STRUCT}[ptrbits]
         # self.ElfRel = {32: datatypes.ElfRel32, 64: datatypes.ElfRel64}[ptrsize]
         # self.ElfLinkMap = {32: datatypes.ElfLinkMap32, 64: datatypes.ElfLinkMap64}[ptrsize]
 
@@ -52,23 +189,10 @@ class ELFBuilder:
         # or we can encounter a SIGILL.
         self.e_machine: int = e_machine
 
-        null_section = Section(
-            "doesntmatter",
-            b"",
-            header=self.ElfShdr(
-                sh_name=0,
-                sh_type=0,
-                sh_flags=0,
-                sh_addr=0,
-                sh_size=0,
-                sh_link=0,
-                sh_info=0,
-                sh_addralign=1,
-                sh_entsize=0,
-                sh_offset=0,
-            ),
-        )
-        self.sections: list[Section] = [null_section]
+        self.ptrbits: int = ptrbits
+        self.addr_mask: int = (1 << ptrbits) - 1
+
+        self.sections: list[Section] = [_NULL_SECTION]
         self.shstrtab = SHStrTab()
 
     def add_text_section(self, addr: int) -> None:
@@ -76,7 +200,7 @@ class ELFBuilder:
         sec = Section(
             name=".text",
             data=b"",
-            header=self.ElfShdr(
+            header=SectionHeader(
                 sh_name=name_offset,
                 sh_type=datatypes.Constants.SHT_NOBITS,
                 sh_flags=datatypes.Constants.SHF_ALLOC | datatypes.Constants.SHF_EXECINSTR,
@@ -91,54 +215,49 @@ class ELFBuilder:
         )
         self.sections.append(sec)
 
-    def add_symbols(self, symbols: list[Symbol]) -> None:
-        strtab = b"\x00"
-        name_offsets = {}
-        max_addr: int = 0
-        for s in symbols:
-            name_offsets[s.name] = len(strtab)
-            strtab += s.name.encode() + b"\x00"
-            max_addr = max(max_addr, s.value + s.size)
+    def add_symbols(self, symbols: SymbolTable) -> None:
+        # Symbols sharing a name also share the strtab entry, so every distinct name
+        # is only encoded and stored once.
+        names = dict.fromkeys(symbols.names)
+        encoded = list(map(str.encode, names))
+        # Build the whole table with one join, and get the offsets of the names in it by
+        # summing up the lengths of the preceding (null terminated) names.
+        strtab = b"\x00".join([b"", *encoded, b""])
+        name_offsets = itertools.accumulate(
+            map(operator.add, map(len, encoded), itertools.repeat(1)),
+            initial=1,
+        )
+        if len(names) == len(symbols):
+            # No duplicates, so the names are already in symbol order.
+            st_name = array.array("I", name_offsets)
+            st_name.pop()  # The end of the table.
+        else:
+            st_name = array.array(
+                "I",
+                map(dict(zip(names, name_offsets, strict=False)).__getitem__, symbols.names),
+            )
+        max_addr: int = max(map(operator.add, symbols.values, symbols.sizes), default=0)
 
         # Fix .text section size so examining in GDB works properly.
         # We do +1 to cover the last symbol even if its size=0.
         # Note that this may be bigger than the .text section of the loaded objfile we are trying to
         # symbolicate (e.g. it may include the .data and .bss sections), it doesn't matter.
-        self.sections[1].header.sh_size = max_addr + 1 - self.sections[1].header.sh_addr
-
-        symtab_entries = [
-            self.ElfSym(
-                st_name=0,
-                st_value=0,
-                st_size=0,
-                bind=0,
-                typ=0,
-                st_other=0,
-                st_shndx=0,
-            ),
-        ] + [
-            self.ElfSym(
-                st_name=name_offsets[s.name],
-                st_value=s.value,
-                st_size=s.size,
-                bind=s.bind,
-                typ=s.typ,
-                st_other=0,
-                st_shndx=1,  # Sucks that we are hardcoding, this is .text
-            )
-            for s in symbols
-        ]
+        # The size wraps around like the unsigned field it ends up in.
+        text = self.sections[1].header
+        text.sh_size = (max_addr + 1 - text.sh_addr) & self.addr_mask
 
         # We add symtab then strtab,
         # so the strtab index = len(self.sections) - 1 + 2
         strtab_index = len(self.sections) + 1
 
-        symtab_data = b"".join(bytes(e) for e in symtab_entries)
+        symtab_data = _pack_symtab(self.ptrbits, symbols, st_name)
+        entsize = _SYM_ENTSIZE[self.ptrbits]
+
         symtab_name_offset = self.shstrtab.add(".symtab")
         symtab_sec = Section(
             name=".symtab",
             data=symtab_data,
-            header=self.ElfShdr(
+            header=SectionHeader(
                 sh_name=symtab_name_offset,
                 sh_type=datatypes.Constants.SHT_SYMTAB,
                 sh_flags=0,
@@ -153,7 +272,7 @@ class ELFBuilder:
                 sh_addralign=8,
                 # Fucking crucial, or you'll fail a check in GDB's bfd/elf.c:bfd_section_from_shdr
                 # if (hdr->sh_entsize != bed->s->sizeof_sym)
-                sh_entsize=ctypes.sizeof(self.ElfSym),
+                sh_entsize=entsize,
                 sh_offset=-1,
             ),
         )
@@ -163,7 +282,7 @@ class ELFBuilder:
         strtab_sec = Section(
             name=".strtab",
             data=strtab,
-            header=self.ElfShdr(
+            header=SectionHeader(
                 sh_name=strtab_name_offset,
                 sh_type=datatypes.Constants.SHT_STRTAB,
                 sh_flags=0,
@@ -183,15 +302,16 @@ class ELFBuilder:
 
         # Fix section offsets now. (but skip the NULL section)
         for sec in self.sections[1:]:
-            offset = align(offset, sec.header.sh_addralign)
+            addralign = sec.header.sh_addralign
+            offset = (offset + addralign - 1) & -addralign  # align() inlined
             sec.header.sh_offset = offset
-            offset += len(sec.padded_data())
+            offset += sec.padded_len
 
         shstrtab_sec_name_offset: int = self.shstrtab.add(".shstrtab")
         shstrtab_sec = Section(
             name=".shstrtab",
             data=self.shstrtab.data,
-            header=self.ElfShdr(
+            header=SectionHeader(
                 sh_name=shstrtab_sec_name_offset,
                 sh_type=datatypes.Constants.SHT_STRTAB,
                 sh_flags=0,
@@ -210,36 +330,46 @@ class ELFBuilder:
         shnum = len(self.sections) + 1  # all + shstrtab
         shstrndx = shnum - 1
 
-        header = self.ElfEhdr(
-            e_ident=self.e_ident,
-            e_type=datatypes.Constants.ET_EXEC,
-            e_machine=self.e_machine,
-            e_version=1,
-            e_entry=0,
-            e_phoff=0,
-            e_shoff=shoff,
-            e_flags=0,
-            e_ehsize=ctypes.sizeof(self.ElfEhdr),
-            e_phentsize=0,
-            e_phnum=0,
-            e_shentsize=ctypes.sizeof(self.ElfShdr),
-            e_shnum=shnum,
-            e_shstrndx=shstrndx,
+        ehsize = self.EhdrStruct.size
+        shentsize = self.ShdrStruct.size
+
+        # Only the ELF header and the section header table are packed here. The section contents
+        # are handed to the kernel straight from their own buffers, together with everything
+        # else in a single gather write, instead of a seek and a write per piece.
+        ehdr = self.EhdrStruct.pack(
+            self.e_ident,
+            datatypes.Constants.ET_EXEC,  # e_type
+            self.e_machine,
+            1,  # e_version
+            0,  # e_entry
+            0,  # e_phoff
+            shoff,
+            0,  # e_flags
+            ehsize,
+            0,  # e_phentsize
+            0,  # e_phnum
+            shentsize,
+            shnum,
+            shstrndx,
         )
+        shdrs = bytearray(shentsize * shnum)
+        for i, sec in enumerate([*self.sections, shstrtab_sec]):
+            sec.pack_header_into(self.ShdrStruct, shdrs, i * shentsize)
 
-        with Path(path).open("wb") as f:
-            f.write(bytes(header))
+        chunks: list[bytes | bytearray | memoryview] = [ehdr]
+        end = ehsize
 
-            # write sections (but skip the NULL section)
-            for sec in self.sections[1:]:
-                f.seek(sec.header.sh_offset)
-                f.write(sec.padded_data())
+        # write sections (but skip the NULL section)
+        for sec in [*self.sections[1:], shstrtab_sec]:
+            start = sec.header.sh_offset
+            if start > end:
+                chunks.append(_padding(start - end))
+            chunks.append(sec.data)
+            end = start + len(sec.data)
 
-            # write shstrtab
-            f.seek(shstrtab_sec.header.sh_offset)
-            f.write(shstrtab_sec.data)
+        # write section headers
+        if shoff > end:
+            chunks.append(_padding(shoff - end))
+        chunks.append(shdrs)
 
-            # write section headers
-            f.seek(shoff)
-            for sec in [*self.sections, shstrtab_sec]:
-                f.write(sec.packed_header())
+        _write_chunks(path, chunks)
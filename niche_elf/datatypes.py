@@ -32,6 +32,7 @@
 #
 
 import ctypes
+import struct
 import typing
 
 Elf32_Addr = ctypes.c_uint32
@@ -978,3 +979,13 @@ class ElfLinkMap64(ctypes.Structure):
         self.l_ld = l_ld
         self.l_next = l_next
         self.l_prev = l_prev
+
+
+# Precompiled little endian `struct` layouts of the ELF and section headers above, used
+# when writing them out. Packing through a `struct.Struct` is a lot cheaper than
+# instantiating a `ctypes.Structure` and calling `bytes()` on it. The field order
+# matches the `_fields_` of the corresponding structure.
+EHDR32_STRUCT = struct.Struct("<16sHHIIIIIHHHHHH")
+EHDR64_STRUCT = struct.Struct("<16sHHIQQQIHHHHHH")
+SHDR32_STRUCT = struct.Struct("<IIIIIIIIII")
+SHDR64_STRUCT = struct.Struct("<IIQQQQIIQQ")
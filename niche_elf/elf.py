@@ -1,12 +1,24 @@
 """The main library entrypoint."""
 
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 from . import datatypes
 from .builder import ELFBuilder
-from .structures import Symbol
+from .structures import SymbolTable
 from .util import zig_target_arch_to_elf
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
 DEFAULT_BIND: int = datatypes.Constants.STB_GLOBAL
 
+# Resolved once here since the `add_*` methods below are called once per symbol.
+_STT_COMMON: int = datatypes.Constants.STT_COMMON
+_STT_FUNC: int = datatypes.Constants.STT_FUNC
+_STT_OBJECT: int = datatypes.Constants.STT_OBJECT
+
 
 class ELFFile:
     """Represents an ELF file (public API)."""
@@ -39,7 +51,7 @@ class ELFFile:
         self.textbase: int = textbase
         self.zig_target_arch: str = zig_target_arch
         self.ptrsize: int = ptrbits
-        self.symbols: list[Symbol] = []
+        self.symbols: SymbolTable = SymbolTable()
 
     # I'm not sure whether size=0 or size=ptrsize or whatever makes a difference as a default.
     # I don't observer a difference.
@@ -52,15 +64,33 @@ class ELFFile:
         bind: int = DEFAULT_BIND,
     ) -> None:
         """If you don't know whether the symbols is a function or global variable use this."""
-        self.symbols.append(Symbol.generic(name, addr, size, bind))
+        self.symbols.add(name, bind, _STT_COMMON, addr, size)
 
     def add_function(self, name: str, addr: int, size: int = 0, bind: int = DEFAULT_BIND) -> None:
         """Use this if you know the symbol is a function."""
-        self.symbols.append(Symbol.function(name, addr, size, bind))
+        self.symbols.add(name, bind, _STT_FUNC, addr, size)
 
     def add_object(self, name: str, addr: int, size: int = 0, bind: int = DEFAULT_BIND) -> None:
         """Use this if you know the symbols is a global or local variable."""
-        self.symbols.append(Symbol.object(name, addr, size, bind))
+        self.symbols.add(name, bind, _STT_OBJECT, addr, size)
+
+    def add_symbols_bulk(
+        self,
+        names: Sequence[str],
+        values: Iterable[int],
+        sizes: Iterable[int],
+        binds: Iterable[int],
+        typs: Iterable[int],
+    ) -> None:
+        """
+        Add many symbols at once, given one column per field.
+
+        This is a lot faster than calling the `add_*` methods in a loop. `typs` are
+        symbol types, e.g. `Constants.STT_FUNC`. Raises a ValueError if the columns
+        don't all have the same length, and an OverflowError if a value doesn't fit in
+        its field. Nothing is added in either case.
+        """
+        self.symbols.add_columns(names, binds, typs, values, sizes)
 
     def write(self, path: str) -> None:
         writer = ELFBuilder(zig_target_arch_to_elf(self.zig_target_arch), self.ptrsize)
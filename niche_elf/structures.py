@@ -2,13 +2,17 @@
 
 from __future__ import annotations
 
+import array
+import itertools
+import operator
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, SupportsIndex, overload
 
 from . import datatypes
 
 if TYPE_CHECKING:
-    import ctypes
+    import struct
+    from collections.abc import Iterable, Iterator, Sequence
 
 
 @dataclass
@@ -54,21 +58,162 @@ class Symbol:
 
 
 @dataclass
+class SymbolTable:
+    """
+    A list of symbols, stored column-wise.
+
+    Keeping one `Symbol` object per symbol gets expensive when there are hundreds of
+    thousands of them, so instead every field is kept in its own flat array. This is
+    also the layout the symtab serializer wants.
+
+    It still behaves like the `list[Symbol]` it replaces for `len()`, iteration, indexing,
+    `append()` and `extend()`. The `Symbol` objects are created on access though, so
+    modifying one doesn't modify the table.
+    """
+
+    names: list[str] = field(default_factory=list)
+    values: array.array[int] = field(default_factory=lambda: array.array("Q"))
+    sizes: array.array[int] = field(default_factory=lambda: array.array("Q"))
+    # st_info, i.e. (bind << 4) | typ
+    infos: array.array[int] = field(default_factory=lambda: array.array("B"))
+
+    def add(self, name: str, bind: int, typ: int, value: int, size: int) -> None:
+        """
+        Add one symbol, given its fields.
+
+        Raises an OverflowError if `value` or `size` don't fit in 64 bits, or `bind` or `typ`
+        don't fit in their 4 bits of st_info. The table is left unchanged in that case.
+        """
+        if bind >> 4 or typ >> 4:
+            raise OverflowError(f"bind and typ must fit in 4 bits, got {bind} and {typ}")
+        count = len(self.names)
+        try:
+            self.values.append(value)
+            self.sizes.append(size)
+        except (OverflowError, TypeError):
+            # Don't leave the columns with different lengths behind.
+            del self.values[count:]
+            del self.sizes[count:]
+            raise
+        self.infos.append((bind << 4) | typ)
+        self.names.append(name)
+
+    def add_columns(
+        self,
+        names: Sequence[str],
+        binds: Iterable[int],
+        typs: Iterable[int],
+        values: Iterable[int],
+        sizes: Iterable[int],
+    ) -> None:
+        """
+        Add many symbols at once, given one column per field.
+
+        Raises a ValueError if the columns don't all have the same length, and an OverflowError
+        under the same conditions as `add()`. No symbols are added in either case.
+        """
+        # Convert everything before touching the table, so a bad value doesn't leave it
+        # with columns of different lengths.
+        new_values = array.array("Q", values)
+        new_sizes = array.array("Q", sizes)
+        new_binds = array.array("B", binds)
+        new_typs = array.array("B", typs)
+        if not (len(names) == len(new_values) == len(new_sizes) == len(new_binds) == len(new_typs)):
+            raise ValueError("All symbol columns must have the same length.")
+        if max(map(operator.or_, new_binds, new_typs), default=0) >> 4:
+            raise OverflowError("bind and typ must fit in 4 bits.")
+        new_infos = array.array(
+            "B",
+            map(operator.or_, map(operator.lshift, new_binds, itertools.repeat(4)), new_typs),
+        )
+
+        self.names.extend(names)
+        self.values.extend(new_values)
+        self.sizes.extend(new_sizes)
+        self.infos.extend(new_infos)
+
+    def append(self, symbol: Symbol) -> None:
+        self.add(symbol.name, symbol.bind, symbol.typ, symbol.value, symbol.size)
+
+    def extend(self, symbols: Iterable[Symbol]) -> None:
+        symbols = list(symbols)
+        self.add_columns(
+            [s.name for s in symbols],
+            [s.bind for s in symbols],
+            [s.typ for s in symbols],
+            [s.value for s in symbols],
+            [s.size for s in symbols],
+        )
+
+    def __len__(self) -> int:
+        """Return the number of symbols."""
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[Symbol]:
+        """Iterate over the symbols as `Symbol` objects."""
+        columns = zip(self.names, self.infos, self.values, self.sizes, strict=True)
+        for name, info, value, size in columns:
+            yield Symbol(name=name, bind=info >> 4, typ=info & 0xF, value=value, size=size)
+
+    @overload
+    def __getitem__(self, index: SupportsIndex) -> Symbol: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Symbol]: ...
+
+    def __getitem__(self, index: SupportsIndex | slice) -> Symbol | list[Symbol]:
+        """Return the symbol at `index` as a `Symbol` object, or a list of them for a slice."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        info = self.infos[index]
+        return Symbol(
+            name=self.names[index],
+            bind=info >> 4,
+            typ=info & 0xF,
+            value=self.values[index],
+            size=self.sizes[index],
+        )
+
+
+@dataclass(slots=True)
+class SectionHeader:
+    """
+    The fields of a section header, in on-disk order.
+
+    https://www.man7.org/linux/man-pages/man5/elf.5.html#:~:text=Section%20header%20%28Shdr
+    """
+
+    sh_name: int
+    sh_type: int
+    sh_flags: int
+    sh_addr: int
+    sh_offset: int
+    sh_size: int
+    sh_link: int
+    sh_info: int
+    sh_addralign: int
+    sh_entsize: int
+
+
+@dataclass(slots=True)
 class Section:
     # `name` is not in the section header, but rather added to the shstrtab.
     name: str
     # `data` is the data of the section (also not in the section header)
-    data: bytes
-    # https://www.man7.org/linux/man-pages/man5/elf.5.html#:~:text=Section%20header%20%28Shdr
-    header: ctypes.Structure
+    data: bytes | bytearray
+    # Plain slotted fields rather than a `datatypes.ElfShdr*`, since the header is only
+    # ever accessed field by field and then packed with a `datatypes.SHDR*_STRUCT`.
+    header: SectionHeader
     # self.header.sh_offset should initially be set to -1 and then later populated
     # during write.
 
-    def padded_data(self) -> bytes:
-        pad_len = (-len(self.data)) % self.header.sh_addralign
-        return bytes(self.data + b"\x00" * pad_len)
+    @property
+    def padded_len(self) -> int:
+        """Length of the data once padded to `sh_addralign`."""
+        return len(self.data) + (-len(self.data)) % self.header.sh_addralign
 
-    def packed_header(self) -> bytes:
+    def pack_header_into(self, shdr_struct: struct.Struct, buf: bytearray, offset: int) -> None:
+        """Pack the section header into `buf` at `offset`, using a `datatypes.SHDR*_STRUCT`."""
         if len(self.data) > self.header.sh_size:
             raise AssertionError(
                 f"Section data is bigger than sh_size for section {self.name} "
@@ -77,7 +222,21 @@ class Section:
         if self.header.sh_offset == -1:
             raise AssertionError(f"sh_offset in section {self.name} was not initialized.")
 
-        return bytes(self.header)
+        h = self.header
+        shdr_struct.pack_into(
+            buf,
+            offset,
+            h.sh_name,
+            h.sh_type,
+            h.sh_flags,
+            h.sh_addr,
+            h.sh_offset,
+            h.sh_size,
+            h.sh_link,
+            h.sh_info,
+            h.sh_addralign,
+            h.sh_entsize,
+        )
 
 
 @dataclass
@@ -89,11 +248,17 @@ class SHStrTabEntry:
 @dataclass
 class SHStrTab:
     entries: list[SHStrTabEntry] = field(default_factory=list)
-    data: bytes = b"\x00"
+    data: bytearray = field(default_factory=lambda: bytearray(b"\x00"))
+    # name -> offset, so adding a name twice reuses the first entry.
+    offsets: dict[str, int] = field(default_factory=dict)
 
     def add(self, name: str) -> int:
-        """Add a name and return its offset."""
-        offset = len(self.data)
-        self.entries.append(SHStrTabEntry(name, offset))
-        self.data += name.encode() + b"\x00"
+        """Add a name (if it's not in the table yet) and return its offset."""
+        offset = self.offsets.get(name)
+        if offset is None:
+            offset = len(self.data)
+            self.offsets[name] = offset
+            self.entries.append(SHStrTabEntry(name, offset))
+            self.data += name.encode()
+            self.data.append(0)
         return offset